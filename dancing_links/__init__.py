@@ -0,0 +1,2 @@
+from .dancing_links import Instance
+from .sudoku import Sudoku
@@ -3,65 +3,30 @@
 import sys
 import unittest
 import argparse
-from functools import reduce
-from itertools import groupby, product
-
-first = lambda p: p[0]
-second =  lambda p: p[1]
-
-class Cell:
-    '''2D doubly linked list'''
-    def __init__(self):
-        self.N = self.E = self.S = self.W = self
-
-    def insert_E(self, other):
-        other.W, other.E = self, self.E
-        self.E.W = self.E = other
-
-    def insert_S(self, other):
-        other.N, other.S = self, self.S
-        self.S.N = self.S = other
-
-    def iter_dir(self, direction):
-        '''Iterates in direction starting at curent cell, does not include
-        current cell'''
-        cur = self
-        while (cur := getattr(cur, direction)) != self:
-            yield cur
-
-class Link(Cell):
-    def __init__(self, C=None, row=-1):
-        Cell.__init__(self)
-        self.C = C
-        self.row = row
-
-def link_row(lst):
-    def link(a, b):
-        a.insert_E(b)
-        return b
-    reduce(link, lst)
-
-class Col(Cell):
-    def __init__(self, count=0):
-        Cell.__init__(self)
-        self.count = count
-
-    def cover(self):
-        self.E.W, self.W.E = self.W, self.E
-        for row in self.iter_dir('S'):
-            for cell in row.iter_dir('E'):
-                cell.N.S, cell.S.N = cell.S, cell.N
-                cell.C.count -= 1
+import copy
+from concurrent.futures import ProcessPoolExecutor
 
-    def uncover(self):
-        for row in self.iter_dir('N'):
-            for cell in row.iter_dir('W'):
-                cell.C.count += 1
-                cell.N.S = cell.S.N = cell
-        self.E.W = self.W.E = self
+def walk(links, start):
+    '''Follows links starting at node start, does not include start'''
+    cur = start
+    while (cur := links[cur]) != start:
+        yield cur
 
 class Instance:
-    '''An instance of an exact cover problem'''
+    '''An instance of an exact cover problem
+
+    The matrix is stored as a 2D circular doubly linked list laid out in flat
+    lists indexed by node: L, R, U, D are the neighbours of each node, C its
+    column header and row its row number. Node 0 is the head, followed by the
+    column headers, and count[c] is the number of entries under header c.
+
+    Live columns are also kept in circular lists by count, linked through
+    size_next and size_prev: the list of columns with k entries starts at
+    node buckets + k, so the column with least branches is found without
+    scanning every column. When cover moves column C[j] to a lower bucket,
+    size_saved[j] keeps its old predecessor, so uncover puts it back in the
+    same place and ties are broken the same way after backtracking.
+    '''
     def __init__(self, rows, cols):
         ''' Cols is a sequence of column names, rows is a sequence of tuples of
         column names
@@ -80,32 +45,151 @@ class Instance:
         return Instance(rows, cols)
 
     def __iter__(self):
-        '''Iterates through rows of matrix, return a pair of row number and
-        items in that row'''
-        for k, g in groupby(self.entries, key=first):
-            yield list(g)
+        '''Iterates through nonempty rows of matrix, returning the slice of
+        entries, pairs of row number and column index, in that row'''
+        end = 0
+        for row in self.rows:
+            start, end = end, end + len(row)
+            if end > start:
+                yield self.entries[start:end]
 
     def initialize(self):
-        # Initialize head node
-        head = Col()
-
-        # Build column headers
-        cols = [Col() for i in range(len(self.cols))]
-        link_row(cols)
-        cols[-1].insert_E(head)
-
-        # Build rows
-        for row in self:
-            cur_row = []
-            for ri, ci in row:
-                col_header = cols[ci].S
-                col_header.count += 1
-                link = Link(C=col_header, row=ri)
-                cols[ci].insert_S(link)
-                cols[ci] = link
-                cur_row.append(link)
-            link_row(cur_row)
-        self.head = head
+        entries = sorted(self.entries)
+        ncols = len(self.cols)
+        n = ncols + 1 + len(entries)
+        L, R = list(range(-1, n - 1)), list(range(1, n + 1))
+        U, D = [0] * n, [0] * n
+        C = list(range(ncols + 1)) + [ci + 1 for ri, ci in entries]
+        row = [-1] * (ncols + 1) + [ri for ri, ci in entries]
+        count = [0] * (ncols + 1)
+        starts = [-1] * len(self.rows)
+
+        # Build rows, appending each entry to the bottom of its column. Nodes
+        # start linked left and right to their neighbours in node order, so
+        # only the ends of each row are joined up
+        tails = list(range(ncols + 1))
+        start = ncols + 1
+        for i in range(ncols + 1, n):
+            h = C[i]
+            U[i], D[tails[h]] = tails[h], i
+            tails[h] = i
+            count[h] += 1
+            if row[i] != row[i - 1]:
+                L[start], R[i - 1] = i - 1, start
+                start = starts[row[i]] = i
+        if n > ncols + 1:
+            L[start], R[n - 1] = n - 1, start
+
+        # The first entry starts a row as well, which links the last header
+        # to it, so close the ring of head node and column headers afterwards
+        L[0], R[ncols] = ncols, 0
+        for h in range(1, ncols + 1):
+            U[h], D[tails[h]] = tails[h], h
+
+        self.L, self.R, self.U, self.D, self.C, self.row = L, R, U, D, C, row
+        self.count = count
+        self.starts = starts
+        self.head = 0
+
+        # Bucket columns by count, lowest index first within each bucket
+        self.buckets = ncols + 1
+        nbuckets = max(count) + 1
+        N = self.size_next = list(range(ncols + 1 + nbuckets))
+        P = self.size_prev = list(range(ncols + 1 + nbuckets))
+        self.size_saved = [0] * n
+        for h in reversed(range(1, ncols + 1)):
+            b = self.buckets + count[h]
+            N[h], P[h] = N[b], b
+            P[N[b]] = N[b] = h
+
+    def snapshot(self):
+        '''Returns copies of the lists changed by cover and uncover, which
+        restore puts back'''
+        return (self.L.copy(), self.R.copy(), self.U.copy(), self.D.copy(),
+                self.count.copy(), self.size_next.copy(), self.size_prev.copy())
+
+    def copy(self):
+        '''Returns an instance sharing the matrix structure with this one,
+        with its own copies of the lists changed by cover and uncover'''
+        inst = copy.copy(self)
+        (inst.L, inst.R, inst.U, inst.D, inst.count,
+         inst.size_next, inst.size_prev) = self.snapshot()
+        inst.size_saved = self.size_saved.copy()
+        return inst
+
+    def restore(self, snap):
+        '''Copies a snapshot back into the lists in place'''
+        for links, saved in zip((self.L, self.R, self.U, self.D, self.count,
+                                 self.size_next, self.size_prev), snap):
+            links[:] = saved
+
+    def select(self, ri):
+        '''Forces row ri into every cover by covering its columns, covers found
+        afterwards list only the other rows. Returns False, changing nothing,
+        if one of its columns is already covered'''
+        L, R, C = self.L, self.R, self.C
+        if self.starts[ri] == -1: # empty row, nothing to cover
+            return True
+        nodes = [self.starts[ri], *walk(R, self.starts[ri])]
+        if any(R[L[C[j]]] != C[j] for j in nodes):
+            return False
+        for j in nodes:
+            self.cover(C[j])
+        return True
+
+    def choose(self):
+        '''Returns a live column with least branches'''
+        N, b = self.size_next, self.buckets
+        while N[b] == b:
+            b += 1
+        return N[b]
+
+    def cover(self, c):
+        L, R, U, D, C, count = self.L, self.R, self.U, self.D, self.C, self.count
+        N, P, S = self.size_next, self.size_prev, self.size_saved
+        buckets = self.buckets
+        L[R[c]], R[L[c]] = L[c], R[c]
+        N[P[c]], P[N[c]] = N[c], P[c]
+        i = D[c]
+        while i != c:
+            j = R[i]
+            while j != i:
+                u, d = U[j], D[j]
+                U[d], D[u] = u, d
+                # Move column down to the bucket for its new count
+                h = C[j]
+                count[h] = k = count[h] - 1
+                n, p = N[h], P[h]
+                N[p], P[n] = n, p
+                S[j] = p
+                b = buckets + k
+                n = N[b]
+                N[h], P[h] = n, b
+                P[n] = N[b] = h
+                j = R[j]
+            i = D[i]
+
+    def uncover(self, c):
+        L, R, U, D, C, count = self.L, self.R, self.U, self.D, self.C, self.count
+        N, P, S = self.size_next, self.size_prev, self.size_saved
+        i = U[c]
+        while i != c:
+            j = L[i]
+            while j != i:
+                # Move column back up to where it was in its old bucket
+                h = C[j]
+                count[h] += 1
+                n, p = N[h], P[h]
+                N[p], P[n] = n, p
+                p = S[j]
+                n = N[p]
+                N[h], P[h] = n, p
+                P[n] = N[p] = h
+                U[D[j]] = D[U[j]] = j
+                j = L[j]
+            i = U[i]
+        N[P[c]] = P[N[c]] = c
+        L[R[c]] = R[L[c]] = c
 
     @property
     def dancing_links(self):
@@ -114,25 +198,77 @@ class Instance:
 
         Implements Knuth's algorithm: https://arxiv.org/abs/cs/0011047
         '''
+        return self.search()
+
+    def parallel_dancing_links(self, processes=None):
+        '''Returns a list of all exact covers, in the same order as
+        dancing_links, searching each branch of the root in its own process'''
+        if self.R[self.head] == self.head:
+            return [()]
+        branches = self.branches()
+        with ProcessPoolExecutor(processes, initializer=init_worker,
+                                 initargs=(self,)) as pool:
+            results = pool.map(search_branch, branches)
+            return [cover for covers in results for cover in covers]
+
+    def branches(self):
+        '''Returns the row nodes of the column with least branches, each the
+        root of a disjoint part of the search'''
+        return list(walk(self.D, self.choose()))
+
+    def search(self, root=None):
+        '''Runs Algorithm X with an explicit stack, out holds the row chosen
+        for each covered column. If root is given, only searches covers
+        containing that row node, chosen for its column first'''
+        head, R, L, D, C, rows = self.head, self.R, self.L, self.D, self.C, self.row
+        choose, cover, uncover = self.choose, self.cover, self.uncover
         out = []
-        def search():
-            if self.head.E == self.head:
-                yield tuple(o.row for o in out)
+        while True:
+            if R[head] == head:
+                yield tuple(map(rows.__getitem__, out))
+                row = None
             else:
                 # Choose column c with least branches
-                col = min(self.head.iter_dir('E'), key=lambda c: c.count)
-                col.cover()
-                for row in col.iter_dir('S'):
-                    out.append(row)
-                    for cell in row.iter_dir('E'):
-                        cell.C.cover()
-                    for result in search():
-                        yield result
-                    row = out.pop()
-                    for cell in row.iter_dir('W'): # order reversed when uncovering
-                        cell.C.uncover()
-                col.uncover()
-        return search()
+                if root is not None and not out:
+                    col = C[root]
+                else:
+                    col = choose()
+                if D[col] == col:
+                    # Dead end, backtrack without covering the column
+                    row = None
+                else:
+                    cover(col)
+                    row = D[col] if root is None or out else root
+
+            # Backtrack until some column has a next row to try
+            while row is None:
+                if not out:
+                    return
+                row = out.pop()
+                j = L[row]
+                while j != row: # order reversed when uncovering
+                    uncover(C[j])
+                    j = L[j]
+                col, row = C[row], D[row]
+                if row == col or (root is not None and not out):
+                    uncover(col)
+                    row = None
+
+            out.append(row)
+            j = R[row]
+            while j != row:
+                cover(C[j])
+                j = R[j]
+
+# Instance searched by a worker process, sent once when it starts
+worker_instance = None
+
+def init_worker(inst):
+    global worker_instance
+    worker_instance = inst
+
+def search_branch(root):
+    return list(worker_instance.search(root))
 
 class TestDancingLinks(unittest.TestCase):
     def test(self):
@@ -145,8 +281,8 @@ class TestDancingLinks(unittest.TestCase):
         inst = Instance.from_matrix(M)
 
         cur = inst.head
-        ones = set((r.row, ci) for ci, col in enumerate(inst.head.iter_dir('E'))
-                               for r in col.iter_dir('S'))
+        ones = set((inst.row[r], ci) for ci, col in enumerate(walk(inst.R, inst.head))
+                                     for r in walk(inst.D, col))
 
         for ri, row in enumerate(M):
             for ci, val in enumerate(row):
@@ -155,7 +291,51 @@ class TestDancingLinks(unittest.TestCase):
                 else:
                     assert (ri, ci) in ones
 
-        assert list(inst.dancing_links) == [(3, 0, 4)]
+        assert list(inst) == [[(ri, ci) for ci, val in enumerate(row) if val]
+                              for ri, row in enumerate(M)]
+        assert list(inst.dancing_links) == [(3, 4, 0)]
+
+    def test_branches(self):
+        M = [[1,0,0,0],
+             [0,1,1,0],
+             [1,0,0,1],
+             [0,0,1,1],
+             [0,1,0,0],
+             [1,1,1,1]]
+        inst = Instance.from_matrix(M)
+        covers = list(inst.dancing_links)
+        assert covers == [(0, 3, 4), (2, 1), (5,)]
+        assert [c for r in inst.branches() for c in inst.search(r)] == covers
+
+        # Ties after backtracking are broken as before it
+        M = [[0,1,1],[0,0,1],[1,1,1],[0,0,0],[0,0,0],[1,0,0],[0,1,1],[1,1,1],
+             [0,1,0]]
+        inst = Instance.from_matrix(M)
+        covers = list(inst.dancing_links)
+        assert covers == [(2,), (5, 0), (5, 1, 8), (5, 6), (7,)]
+        assert [c for r in inst.branches() for c in inst.search(r)] == covers
+
+    def test_snapshot(self):
+        M = [[1,0,0,0],
+             [0,1,1,0],
+             [1,0,0,1],
+             [0,0,1,1],
+             [0,1,0,0],
+             [1,1,1,1]]
+        inst = Instance.from_matrix(M)
+        snap = inst.snapshot()
+        assert inst.select(2)
+        assert not inst.select(0)
+        assert list(inst.dancing_links) == [(1,)]
+        inst.restore(snap)
+        assert list(inst.dancing_links) == [(0, 3, 4), (2, 1), (5,)]
+        other = inst.copy()
+        assert other.select(2)
+        assert list(other.dancing_links) == [(1,)]
+        assert list(inst.dancing_links) == [(0, 3, 4), (2, 1), (5,)]
+        inst = Instance.from_matrix([[1,0],[0,0],[0,1]])
+        assert inst.select(1)
+        assert list(inst.dancing_links) == [(0, 2)]
 
 README = \
 '''Reads in an exact cover instance, defined by one line of space-separated
@@ -168,12 +348,10 @@ if __name__ == '__main__':
 
     # Read a list of column names
     cols = sys.stdin.readline().strip().split(' ')
-    col_index = {col: i for i, col in enumerate(cols)}
 
     # Rest of input are rows
     rows = list(sys.stdin)
-    inst = Instance([(ri, col_index[col]) for ri, row in enumerate(rows)
-                                          for col in row.strip().split(' ')])
+    inst = Instance([row.strip().split(' ') for row in rows], cols)
 
     for link, _ in zip(inst.dancing_links, range(args.limit)):
         print(''.join(rows[r] for r in link))
@@ -1,47 +1,155 @@
 import argparse
+import os
 import sys
+import unittest
 from dancing_links import Instance
 from collections import defaultdict
-from functools import reduce
+from functools import cache, reduce
+from itertools import product
 
 def box(r, c):
     return (r//3) * 3 + c//3
 
 DIGITS = '123456789'
 
+# Bitset form of the 9x9 exact cover matrix: candidate 81*r + 9*c + d places
+# digit d at (r, c), and the 324 constraints are numbered cell, row-digit,
+# column-digit then box-digit.
+def constraints(r, c, d):
+    return (9*r + c, 81 + 9*r + d, 162 + 9*c + d, 243 + 9*box(r, c) + d)
+
+@cache
+def tables():
+    '''Returns the candidates satisfying each constraint, the constraints
+    satisfied by each candidate and the candidates removed when a candidate
+    is chosen, including itself. Built on first use.'''
+    candidates, covers = [0] * 324, []
+    for r, c, d in product(range(9), repeat=3):
+        for k in constraints(r, c, d):
+            candidates[k] |= 1 << len(covers)
+        covers.append(sum(1 << k for k in constraints(r, c, d)))
+    conflicts = [reduce(int.__or__, (candidates[k] for k in constraints(r, c, d)))
+                 for r, c, d in product(range(9), repeat=3)]
+    return candidates, covers, conflicts
+
+def search_bits(remaining, uncovered):
+    '''Algorithm X on bitsets: remaining is the mask of candidates still
+    allowed, uncovered the mask of constraints left to satisfy. Returns a
+    generator of tuples of candidates completing an exact cover.
+    '''
+    candidates, covers, conflicts = tables()
+    out = []
+    def search(remaining, uncovered):
+        if not uncovered:
+            yield tuple(out)
+            return
+        # Choose constraint with fewest candidates, stopping early on a dead
+        # end or a forced move
+        best, best_count, u = -1, 10, uncovered
+        while u and best_count > 1:
+            low = u & -u
+            k = low.bit_length() - 1
+            if (n := (remaining & candidates[k]).bit_count()) < best_count:
+                best, best_count = k, n
+            u ^= low
+        xs = remaining & candidates[best]
+        while xs:
+            low = xs & -xs
+            x = low.bit_length() - 1
+            out.append(x)
+            yield from search(remaining & ~conflicts[x], uncovered & ~covers[x])
+            out.pop()
+            xs ^= low
+    return search(remaining, uncovered)
+
+@cache
+def candidate_shell():
+    '''Returns an Instance with every candidate as a row, in candidate
+    order. Built on first use.'''
+    rows = [(f'p{r}{c}', f'r{r}{d}', f'c{c}{d}', f'b{box(r, c)}{d}')
+            for r, c, d in product(range(9), range(9), DIGITS)]
+    return Instance(rows, list({c: None for row in rows for c in row}))
+
 class Sudoku(Instance):
-    def __init__(self, grid):
+    def __init__(self, grid, shell=None):
+        '''shell defaults to candidate_shell(). Its links are only copied
+        when the DLX search is first used, solutions does not need them.'''
         self.board = [[d if d in DIGITS else '.' for d in row]
                        for row in grid]
-        rs, cs, bs = set(), set(), set()
-        for r in range(9):
-            for c in range(9):
-                if (d := self.board[r][c]):
-                    rs.add((r, d))
-                    cs.add((c, d))
-                    bs.add((box(r, c), d))
-
-        rows = [(f'p{r}{c}', f'r{r}{d}', f'c{c}{d}', f'b{box(r, c)}{d}')
-                for r in range(9) for c in range(9)
-                if self.board[r][c] not in DIGITS
-                for d in DIGITS
-                if not ((r, d) in rs or (c, d) in cs or (box(r, c), d) in bs)]
-
-        cols = reduce(set.union, map(set, rows))
-        Instance.__init__(self, rows, cols)
+        self.shell = shell
+
+    def __getattr__(self, name):
+        '''Builds the links the first time the DLX search reads them: a copy
+        of the shell with the row of each given digit selected. If a given
+        clashes with an earlier one the puzzle is dead and has no covers.'''
+        # Only once, and not for lookups made before __init__ has run
+        if 'dead' in vars(self) or 'shell' not in vars(self):
+            raise AttributeError(name)
+        shell = candidate_shell() if self.shell is None else self.shell
+        links = shell.copy()
+        dead = not all(links.select(81*r + 9*c + DIGITS.index(d))
+                       for r, c in product(range(9), repeat=2)
+                       if (d := self.board[r][c]) in DIGITS)
+        vars(self).update(vars(links), dead=dead)
+        return getattr(self, name)
+
+    def search(self, root=None):
+        return iter(()) if self.dead else Instance.search(self, root)
 
     def board_string(self):
         return '\n'.join(''.join(row) for row in self.board)
 
     @property
     def solutions(self):
-        for links in self.dancing_links:
-            for row in links:
-                pos, rc, _, _ = self.rows[row]
-                r, c, d = int(pos[1]), int(pos[2]), rc[2]
-                self.board[r][c] = d
+        _, covers, conflicts = tables()
+        remaining, uncovered = (1 << 729) - 1, (1 << 324) - 1
+        for r, c in product(range(9), repeat=2):
+            if (d := self.board[r][c]) in DIGITS:
+                x = 81*r + 9*c + DIGITS.index(d)
+                if not remaining >> x & 1: # clashes with another given
+                    return
+                remaining &= ~conflicts[x]
+                uncovered &= ~covers[x]
+
+        for xs in search_bits(remaining, uncovered):
+            for x in xs:
+                self.board[x // 81][x // 9 % 9] = DIGITS[x % 9]
             yield self.board_string()
 
+def example(name):
+    path = os.path.join(os.path.dirname(__file__), 'sudoku_examples', name)
+    with open(path) as f:
+        return [line.strip() for line in f]
+
+class TestSudoku(unittest.TestCase):
+    def test_hard(self):
+        grid = example('hard.in')
+        solutions = list(Sudoku(grid).solutions)
+        assert len(solutions) == 1
+        board = solutions[0].split('\n')
+        assert all(d in ('.', b) for row, brow in zip(grid, board)
+                                for d, b in zip(row, brow))
+        units = ([[(r, c) for c in range(9)] for r in range(9)] +
+                 [[(r, c) for r in range(9)] for c in range(9)] +
+                 [[(r, c) for r in range(9) for c in range(9) if box(r, c) == b]
+                  for b in range(9)])
+        for unit in units:
+            assert sorted(board[r][c] for r, c in unit) == list(DIGITS)
+        assert len(list(Sudoku(grid).dancing_links)) == 1
+
+    def test_impossible(self):
+        assert list(Sudoku(example('impossible.in')).solutions) == []
+
+    def test_clash(self):
+        # A solved grid with (0, 1) changed to repeat the digit at (0, 0)
+        grid = ['554678912', '672195348', '198342567',
+                '859761423', '426853791', '713924856',
+                '961537284', '287419635', '345286179']
+        s = Sudoku(grid)
+        assert s.board[0] == list('554678912')
+        assert list(s.solutions) == []
+        assert list(s.dancing_links) == []
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Reads sudoku instance from file and prints solution(s)')
     parser.add_argument('filename')
@@ -1,5 +1,7 @@
 from z3 import *
 from collections import defaultdict
+from itertools import islice
+from dancing_links import Sudoku as ExactCoverSudoku
 
 class Sudoku():
     def __init__(self):
@@ -26,6 +28,23 @@ class Sudoku():
         self.constraints = cells_c + rows_c + cols_c + sq_c
         self.instance_constraints = []
 
+        # Quantifier-free finite domain theory. Grid and instance rules stay
+        # in the solver, each solve adds its own in a scope it pops afterwards.
+        # loaded holds the grid and instance rules in the solver
+        self.solver = SolverFor("QF_FD")
+        self.loaded = []
+
+        # Filled numbers, '0' for empty cells, and how many of the instance
+        # constraints only fill numbers
+        self.board = [['0'] * 9 for i in range(9)]
+        self.filled = 0
+
+    @property
+    def needs_smt(self):
+        '''Until an instance constraint other than a filled number is added
+        the puzzle is plain exact cover and is solved with dancing links'''
+        return len(self.instance_constraints) > self.filled
+
     def get_groups(self, instance):
         cell_groups = defaultdict(list)
         for i, row in enumerate(instance):
@@ -38,6 +57,11 @@ class Sudoku():
                       for i in range(9) for j in range(9)
                       if instance[i][j] != '0']
         self.instance_constraints += instance_c
+        self.filled += len(instance_c)
+        for i in range(9):
+            for j in range(9):
+                if instance[i][j] != '0':
+                    self.board[i][j] = instance[i][j]
 
     def add_killer_sudoku(self, instance, sums=None, equals=None, gts=None,
                           nes=None, distinct=True):
@@ -55,10 +79,10 @@ class Sudoku():
         self.instance_constraints += sums_c + distinct_c + equals_c + gt_c + nes_c
 
     def add_miracle_rules(self):
-        ortho_move  = [(-1, 0), (1, 0), (0,-1), (0, 1)]
-        king_move   = ortho_move + [(-1,-1), (-1,1), (1,-1), (1, 1)]
-        knight_move = [(-2,-1), (-2, 1), ( 2,-1), ( 2, 1),
-                       ( 1,-2), ( 1, 2), (-1, 2), (-1,-2)]
+        # One direction of each move, so every pair of cells is taken once
+        ortho_move  = [(1, 0), (0, 1)]
+        king_move   = ortho_move + [(1,-1), (1, 1)]
+        knight_move = [(1,-2), (1, 2), (2,-1), (2, 1)]
         valid_cells = set([(i,j) for i in range(9) for j in range(9)])
         add = lambda a,b: (a[0]+b[0], a[1]+b[1])
         get = lambda c: self.X[c[0]][c[1]]
@@ -70,33 +94,66 @@ class Sudoku():
         ortho_c = [And(c1 - c2 != 1, c2 - c1 != 1) for c1, c2 in gen_pairs(ortho_move)]
         self.instance_constraints += move_c + ortho_c
 
-    def solve(self,
-              additional_constraints=None,
-              verbose=True,
-              debug=False,
-              check_uniqueness=False):
-        # Quantifier-free finite domain theory
-        s = SolverFor("QF_FD")
-        additional_constraints = additional_constraints or []
-        s.add(self.constraints + self.instance_constraints + additional_constraints)
-        if debug:
-            print('Sudoku Constraints', self.constraints)
-            print('Instance Constraints', self.instance_constraints)
-        if s.check() == sat:
-            m = s.model()
-            r = '\n'.join(''.join(str(m.evaluate(self.X[i][j])) for j in range(9))
-                          for i in range(9))
+    def solve_exact_cover(self, verbose=True, check_uniqueness=False):
+        solutions = list(islice(ExactCoverSudoku(self.board).solutions, 2))
+        if solutions:
             if verbose:
                 print('Solution:')
-                print(r)
+                print(solutions[0])
             if check_uniqueness:
-                s.add(Or(*[Xi != m.evaluate(Xi) for row in self.X for Xi in row]))
-                unique = not (s.check() == sat)
+                unique = len(solutions) == 1
                 if verbose: print(f'Solution {"" if unique else "Not "}Unique!')
                 return unique
         else:
             if verbose: print("failed to solve")
 
+    def load(self):
+        '''Returns the solver with the current grid and instance rules. New
+        rules are added to it, but it is rebuilt if any loaded rule has since
+        been changed or removed.'''
+        rules = self.constraints + self.instance_constraints
+        if (len(rules) < len(self.loaded) or
+                any(a is not b for a, b in zip(self.loaded, rules))):
+            self.solver, self.loaded = SolverFor("QF_FD"), []
+        self.solver.add(rules[len(self.loaded):])
+        self.loaded = rules
+        return self.solver
+
+    def solve(self,
+              additional_constraints=None,
+              verbose=True,
+              debug=False,
+              check_uniqueness=False):
+        if not (self.needs_smt or additional_constraints or debug):
+            return self.solve_exact_cover(verbose, check_uniqueness)
+
+        s = self.load()
+        additional_constraints = additional_constraints or []
+        s.push()
+        try:
+            s.add(additional_constraints)
+            if debug:
+                print('Sudoku Constraints', self.constraints)
+                print('Instance Constraints', self.instance_constraints)
+            if s.check() == sat:
+                m = s.model()
+                r = '\n'.join(''.join(str(m.evaluate(self.X[i][j])) for j in range(9))
+                              for i in range(9))
+                if verbose:
+                    print('Solution:')
+                    print(r)
+                if check_uniqueness:
+                    s.add(Or(*[Xi != m.evaluate(Xi) for row in self.X for Xi in row]))
+                    unique = not (s.check() == sat)
+                    if verbose: print(f'Solution {"" if unique else "Not "}Unique!')
+                    return unique
+            else:
+                if verbose: print("failed to solve")
+        finally:
+            # Drop the additional constraints and uniqueness cut even if
+            # solving is interrupted
+            s.pop()
+
 def solve_sudoku():
     # Normal sudoku instance, we use '0' for empty cells
     instance = \